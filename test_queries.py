@@ -2,6 +2,8 @@
 Test queries from queries.json file against result JSON files
 """
 import json
+import hashlib
+import os
 import duckdb
 import argparse
 from pathlib import Path
@@ -25,11 +27,27 @@ parser.add_argument(
     default=str(ROOT_DIR / "results"),
     help='Directory containing result JSON files (default: results/)'
 )
+parser.add_argument(
+    '--no-cache',
+    action='store_true',
+    help='Always re-parse the result JSON files instead of using the Parquet cache in <results-dir>/.cache/'
+)
+parser.add_argument(
+    '--threads',
+    type=int,
+    default=None,
+    help='Number of DuckDB worker threads (default: DuckDB picks, which may exceed the CPU quota in containers)'
+)
+parser.add_argument(
+    '--memory-limit',
+    type=str,
+    default=None,
+    help="DuckDB memory limit, e.g. '4GB' (default: DuckDB picks)"
+)
 args = parser.parse_args()
 
 queries_path = Path(args.queries)
 results_dir = Path(args.results_dir)
-results_pattern = str(results_dir / "*.json")
 
 print(f"Testing queries from {queries_path.relative_to(ROOT_DIR) if queries_path.is_relative_to(ROOT_DIR) else queries_path}...")
 print(f"Against results in {results_dir.relative_to(ROOT_DIR) if results_dir.is_relative_to(ROOT_DIR) else results_dir}/")
@@ -48,42 +66,106 @@ if not results_dir.exists():
 with open(queries_path, 'r', encoding='utf-8') as f:
     queries = json.load(f)
 
-print(f"Loaded {len(queries)} queries\n")
-
-# Create DuckDB connection and load data
-conn = duckdb.connect()
-conn.execute(f"CREATE TABLE results AS SELECT * FROM read_json('{results_pattern}')")
+print(f"Loaded {len(queries)} queries")
 
 success = []
 failed = []
 warnings = []
 
-for query_info in queries:
+# Without queries nothing reads the results table, so the result files are not loaded
+if queries:
+    # Without result files there is nothing to run the queries against
+    json_files = sorted(results_dir.glob("*.json"))
+    if not json_files:
+        print(f"ERROR: No result JSON files found in: {results_dir}")
+        exit(1)
+
+    # The parsed results are cached as Parquet, keyed by the DuckDB version and the
+    # name, size and mtime of every result file, so JSON is only re-parsed when the
+    # results change or a different DuckDB version might infer a different schema
+    signature = hashlib.sha256(f"duckdb:{duckdb.__version__}\n".encode())
+    for json_file in json_files:
+        stat = json_file.stat()
+        signature.update(f"{json_file.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    cache_path = results_dir / ".cache" / f"{signature.hexdigest()[:16]}.parquet"
+
+    # Create DuckDB connection and load data
+    config = {}
+    if args.threads is not None:
+        config['threads'] = args.threads
+    if args.memory_limit is not None:
+        config['memory_limit'] = args.memory_limit
     try:
-        result = conn.sql(query_info['query'])
-        rows = result.fetchall()
-        columns = [desc[0] for desc in result.description]
-        
-        # Check if 'id' is the first column (required for leaderboard)
-        if columns and columns[0] != 'id':
-            warning_msg = f"First column is '{columns[0]}', but 'id' must be the first column"
-            warnings.append((query_info['name'], warning_msg))
-            print(f"⚠ {query_info['name']}")
-            print(f"  WARNING: {warning_msg}")
-            print(f"  Current columns: {columns}")
-        else:
-            success.append(query_info['name'])
-            print(f"✓ {query_info['name']}")
-        
-        print(f"  Results: {len(rows)} rows")
-        print(f"  Columns: {columns}")
-        if len(rows) > 0:
-            print(f"  Sample: {rows[:2]}")
-    except Exception as e:
-        failed.append((query_info['name'], str(e)))
-        print(f"✗ {query_info['name']}: {str(e)[:100]}")
-
-conn.close()
+        conn = duckdb.connect(config=config)
+    except duckdb.Error as e:
+        print(f"ERROR: Invalid DuckDB settings: {e}")
+        exit(1)
+    loaded_from_cache = False
+    if not args.no_cache and cache_path.exists():
+        try:
+            conn.execute("CREATE TABLE results AS SELECT * FROM read_parquet(?)", [str(cache_path)])
+            loaded_from_cache = True
+            print(f"Using cached results from {cache_path.name}")
+        except duckdb.Error:
+            # An unreadable cache file is discarded and rebuilt from the JSON files
+            print(f"Ignoring unreadable cache file {cache_path.name}")
+            cache_path.unlink(missing_ok=True)
+    if not loaded_from_cache:
+        # Reuse the file list from the signature so DuckDB does not glob the directory again
+        conn.execute("CREATE TABLE results AS SELECT * FROM read_json(?)", [[str(f) for f in json_files]])
+        if not args.no_cache:
+            # Write under a temporary name and move it into place, so an interrupted
+            # write never leaves a truncated file where the next run looks for it
+            tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp")
+            try:
+                cache_path.parent.mkdir(exist_ok=True)
+                conn.table("results").write_parquet(str(tmp_path), compression="zstd")
+                os.replace(tmp_path, cache_path)
+            except (OSError, duckdb.Error) as e:
+                # The cache is only an optimization, the loaded results table is still used
+                print(f"Could not write cache file {cache_path.name}: {e}")
+            else:
+                # Drop cache files of earlier result sets, they can never be hit again,
+                # and temporary files left behind by killed runs
+                stale_files = [*cache_path.parent.glob("*.parquet"), *cache_path.parent.glob("*.tmp")]
+                for stale in stale_files:
+                    if stale not in (cache_path, tmp_path):
+                        stale.unlink(missing_ok=True)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+    print(f"Loaded {conn.execute('SELECT count(*) FROM results').fetchone()[0]} results\n")
+
+    for query_info in queries:
+        try:
+            result = conn.sql(query_info['query'])
+            columns = [desc[0] for desc in result.description]
+            # Stream the rows in chunks, only the sample rows are kept in memory
+            sample = result.fetchmany(2)
+            row_count = len(sample)
+            while chunk := result.fetchmany(1024):
+                row_count += len(chunk)
+            
+            # Check if 'id' is the first column (required for leaderboard)
+            if columns and columns[0] != 'id':
+                warning_msg = f"First column is '{columns[0]}', but 'id' must be the first column"
+                warnings.append((query_info['name'], warning_msg))
+                print(f"⚠ {query_info['name']}")
+                print(f"  WARNING: {warning_msg}")
+                print(f"  Current columns: {columns}")
+            else:
+                success.append(query_info['name'])
+                print(f"✓ {query_info['name']}")
+            
+            print(f"  Results: {row_count} rows")
+            print(f"  Columns: {columns}")
+            if sample:
+                print(f"  Sample: {sample}")
+        except Exception as e:
+            failed.append((query_info['name'], str(e)))
+            print(f"✗ {query_info['name']}: {str(e)[:100]}")
+
+    conn.close()
 
 print("\n" + "="*60)
 print(f"Results: {len(success)} passed, {len(warnings)} warnings, {len(failed)} failed")